@@ -3,12 +3,22 @@ import google.generativeai as genai
 from dotenv import load_dotenv
 import gradio as gr
 import os
+import asyncio
 import re
+import io
 import json
+import orjson
 import hashlib
+from html import escape
+from urllib.parse import quote_plus
+from pathlib import Path
 import time
-from datetime import datetime, timedelta
-import uuid
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from datetime import datetime
 
 # Load environment variables
 load_dotenv()
@@ -19,16 +29,21 @@ class AppConfig:
         self.api_key = os.getenv("GOOGLE_API_KEY")
         self.max_requests_per_hour = 10
         self.max_requests_per_day = 50
+        self.max_concurrent_generations = int(os.getenv("GEMINI_CONCURRENCY", 20))  # In-flight Gemini calls per process
         
         # Auto-detect database type
         self.database_url = os.getenv("DATABASE_URL")  # Railway PostgreSQL
+        self.redis_url = os.getenv("REDIS_URL")  # Optional - moves rate limiting out of the database
+        self.pool_min = int(os.getenv("POOL_MIN", 4))  # PostgreSQL connection pool bounds
+        self.pool_max = int(os.getenv("POOL_MAX", 25))
+        self.statement_timeout_ms = int(os.getenv("PG_STATEMENT_TIMEOUT_MS", 5000))  # 0 disables
         self.use_postgres = self.database_url is not None
         
         if self.use_postgres:
             print("✓ Using PostgreSQL database")
         else:
             print("✓ Using SQLite database (local/development)")
-            self.db_path = os.path.join(os.getcwd(), "user_data.db")
+            self.db_path = str(Path(__file__).resolve().parent / "user_data.db")
         
         self.is_production = os.getenv("RAILWAY_ENVIRONMENT") is not None
         
@@ -40,190 +55,614 @@ class AppConfig:
 config = AppConfig()
 
 # Database connection helper
+def open_conn():
+    """Open a SQLite connection tuned for concurrent Gradio workers"""
+    import sqlite3
+    conn = sqlite3.connect(config.db_path, isolation_level="IMMEDIATE", check_same_thread=False)
+    # journal_mode=WAL is persistent and set once in init_database
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=5000')
+    conn.execute('PRAGMA cache_size=-20000')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+# Process-wide PostgreSQL pool, opened on first use so a database outage doesn't stop the app loading
+_PG_POOL = None
+_PG_POOL_LOCK = threading.Lock()
+
+def get_pg_pool():
+    """Return the shared thread-safe PostgreSQL connection pool"""
+    global _PG_POOL
+    if _PG_POOL is None:
+        with _PG_POOL_LOCK:
+            if _PG_POOL is None:
+                import psycopg2.extensions
+                import psycopg2.pool
+                
+                class PooledConnection(psycopg2.extensions.connection):
+                    statements_prepared = False
+                
+                _PG_POOL = psycopg2.pool.ThreadedConnectionPool(
+                    config.pool_min, config.pool_max, config.database_url,
+                    keepalives=1, keepalives_idle=30, connection_factory=PooledConnection,
+                    # A stalled query fails fast instead of holding a request thread and a pooled connection
+                    options=f'-c statement_timeout={config.statement_timeout_ms}',
+                )
+    return _PG_POOL
+
+def prepare_statements(cursor):
+    """PREPARE the hot-path statements the first time a pooled connection runs one"""
+    if not cursor.connection.statements_prepared:
+        cursor.execute(PG_PREPARED_STATEMENTS)
+        cursor.connection.statements_prepared = True
+    return cursor
+
 def get_db_connection():
-    """Get database connection - PostgreSQL or SQLite"""
+    """Get database connection - a pooled PostgreSQL connection or a new SQLite one"""
+    if config.use_postgres:
+        import psycopg2.pool
+        pool = get_pg_pool()
+        # Back off briefly while every pooled connection is checked out
+        for delay in (0.05, 0.1, 0.2, 0.4):
+            try:
+                return pool.getconn()
+            except psycopg2.pool.PoolError:
+                time.sleep(delay)
+        return pool.getconn()
+    else:
+        return open_conn()
+
+def release_db_connection(conn):
+    """Return a PostgreSQL connection to the pool, discarding it if it has been closed"""
+    get_pg_pool().putconn(conn, close=bool(conn.closed))
+
+# Process-wide SQLite connections: one serialized writer plus a pool of readers,
+# opened on first use so a bad path or read-only mount doesn't stop the app loading
+_WRITE_CONN = None
+_WRITE_LOCK = threading.Lock()
+_READ_POOL = None
+_SQLITE_OPEN_LOCK = threading.Lock()
+
+def get_sqlite_connections():
+    """Return the shared SQLite writer and reader pool, opening them on first use"""
+    global _WRITE_CONN, _READ_POOL
+    if _READ_POOL is None:
+        with _SQLITE_OPEN_LOCK:
+            if _READ_POOL is None:
+                write_conn = open_conn()
+                read_pool = queue.Queue()
+                for _ in range(os.cpu_count() or 1):
+                    read_conn = open_conn()
+                    read_conn.execute('PRAGMA query_only=1')
+                    read_pool.put(read_conn)
+                _WRITE_CONN = write_conn
+                _READ_POOL = read_pool
+    return _WRITE_CONN, _READ_POOL
+
+@contextmanager
+def write_connection():
+    """Yield a connection for writes - SQLite reuses the shared writer"""
     if config.use_postgres:
-        import psycopg2
-        return psycopg2.connect(config.database_url)
+        conn = get_db_connection()
+        try:
+            yield conn
+        finally:
+            release_db_connection(conn)
     else:
-        import sqlite3
-        os.makedirs(os.path.dirname(config.db_path) if os.path.dirname(config.db_path) else '.', exist_ok=True)
-        return sqlite3.connect(config.db_path)
+        write_conn, _ = get_sqlite_connections()
+        with _WRITE_LOCK:
+            try:
+                yield write_conn
+            except Exception:
+                write_conn.rollback()
+                raise
+
+@contextmanager
+def read_connection():
+    """Yield a connection for reads - SQLite borrows from the reader pool"""
+    if config.use_postgres:
+        conn = get_db_connection()
+        try:
+            yield conn
+        finally:
+            release_db_connection(conn)
+    else:
+        _, read_pool = get_sqlite_connections()
+        conn = read_pool.get()
+        try:
+            yield conn
+        finally:
+            read_pool.put(conn)
 
 # Database setup for rate limiting and basic analytics
+# Schema per backend, each sent to the server in a single call
+PG_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        user_id TEXT PRIMARY KEY,
+        hourly_count INTEGER DEFAULT 0,
+        daily_count INTEGER DEFAULT 0,
+        last_hour_reset BIGINT,
+        last_day_reset BIGINT
+    );
+    CREATE TABLE IF NOT EXISTS analytics (
+        id BIGSERIAL PRIMARY KEY,
+        timestamp TIMESTAMP,
+        user_id_hash TEXT,
+        career_field TEXT,
+        employment_status TEXT,
+        request_success BOOLEAN
+    );
+    CREATE TABLE IF NOT EXISTS llm_cache (
+        profile_hash TEXT PRIMARY KEY,
+        courses_json TEXT,
+        created_at BIGINT
+    );
+    DO $$
+    BEGIN
+        -- Rate-limit windows are unix seconds; convert columns created as TIMESTAMP
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_name = 'rate_limits' AND column_name = 'last_hour_reset') LIKE 'timestamp%' THEN
+            ALTER TABLE rate_limits
+                ALTER COLUMN last_hour_reset TYPE BIGINT USING EXTRACT(EPOCH FROM last_hour_reset)::BIGINT,
+                ALTER COLUMN last_day_reset TYPE BIGINT USING EXTRACT(EPOCH FROM last_day_reset)::BIGINT;
+        END IF;
+        -- Older deployments keyed analytics on a random UUID; switch to an append-only BIGSERIAL
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_name = 'analytics' AND column_name = 'id') = 'text' THEN
+            ALTER TABLE analytics DROP COLUMN id;
+            ALTER TABLE analytics ADD COLUMN id BIGSERIAL PRIMARY KEY;
+        END IF;
+    END $$;
+'''
+
+# Built with CONCURRENTLY so redeploys don't block analytics writes; each runs on its own in autocommit
+PG_INDEXES = (
+    # Covers the monitoring queries, which filter on timestamp and aggregate the other columns
+    '''CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_analytics_ts_covering ON analytics (timestamp DESC)
+        INCLUDE (career_field, employment_status, user_id_hash, request_success)''',
+    'DROP INDEX CONCURRENTLY IF EXISTS idx_analytics_ts',
+)
+# Indexes PG_INDEXES builds - the only ones startup may drop and rebuild
+PG_INDEX_NAMES = ('idx_analytics_ts_covering',)
+
+# An interrupted CONCURRENTLY build leaves an invalid index that IF NOT EXISTS would skip over;
+# only this app's indexes are matched, so an operator's own index is left alone
+PG_INVALID_INDEXES = '''
+    SELECT indexrelid::regclass::text FROM pg_index
+    WHERE NOT indisvalid AND indrelid = 'analytics'::regclass
+      AND indexrelid::regclass::text = ANY(%s)
+'''
+
+# Hot-path statements, planned once per pooled PostgreSQL connection and run with EXECUTE
+PG_PREPARED_STATEMENTS = '''
+    -- PREPARE survives a rollback, so a batch retried after a failed transaction starts clean
+    DEALLOCATE ALL;
+    -- One statement per request: reset expired windows, then increment only while under both limits
+    PREPARE rate_limit_upsert (TEXT, BIGINT, INTEGER, INTEGER) AS
+        INSERT INTO rate_limits (user_id, hourly_count, daily_count, last_hour_reset, last_day_reset)
+        VALUES ($1, 1, 1, $2, $2)
+        ON CONFLICT (user_id) DO UPDATE SET
+            hourly_count = CASE WHEN $2 - rate_limits.last_hour_reset > 3600 THEN 1 ELSE rate_limits.hourly_count + 1 END,
+            daily_count = CASE WHEN $2 - rate_limits.last_day_reset > 86400 THEN 1 ELSE rate_limits.daily_count + 1 END,
+            last_hour_reset = CASE WHEN $2 - rate_limits.last_hour_reset > 3600 THEN $2 ELSE rate_limits.last_hour_reset END,
+            last_day_reset = CASE WHEN $2 - rate_limits.last_day_reset > 86400 THEN $2 ELSE rate_limits.last_day_reset END
+        WHERE (CASE WHEN $2 - rate_limits.last_hour_reset > 3600 THEN 0 ELSE rate_limits.hourly_count END) < $3
+          AND (CASE WHEN $2 - rate_limits.last_day_reset > 86400 THEN 0 ELSE rate_limits.daily_count END) < $4
+        RETURNING hourly_count;
+    PREPARE rate_limit_row (TEXT) AS
+        SELECT hourly_count, last_hour_reset FROM rate_limits WHERE user_id = $1;
+    PREPARE load_cached_courses (TEXT, BIGINT) AS
+        SELECT courses_json, created_at FROM llm_cache WHERE profile_hash = $1 AND created_at > $2;
+    PREPARE store_cached_courses (TEXT, TEXT, BIGINT) AS
+        INSERT INTO llm_cache (profile_hash, courses_json, created_at) VALUES ($1, $2, $3)
+        ON CONFLICT (profile_hash) DO UPDATE SET courses_json = excluded.courses_json, created_at = excluded.created_at;
+    PREPARE log_analytics (TIMESTAMP, TEXT, TEXT, TEXT, BOOLEAN) AS
+        INSERT INTO analytics (timestamp, user_id_hash, career_field, employment_status, request_success)
+        VALUES ($1, $2, $3, $4, $5);
+'''
+
+SQLITE_TABLES = '''
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        user_id TEXT PRIMARY KEY,
+        hourly_count INTEGER DEFAULT 0,
+        daily_count INTEGER DEFAULT 0,
+        last_hour_reset INTEGER,
+        last_day_reset INTEGER
+    );
+    -- Rate-limit windows are unix seconds; convert rows written as ISO strings
+    UPDATE rate_limits SET
+        last_hour_reset = CASE WHEN typeof(last_hour_reset) = 'integer' THEN last_hour_reset
+            ELSE COALESCE(CAST(strftime('%s', last_hour_reset, 'utc') AS INTEGER), 0) END,
+        last_day_reset = CASE WHEN typeof(last_day_reset) = 'integer' THEN last_day_reset
+            ELSE COALESCE(CAST(strftime('%s', last_day_reset, 'utc') AS INTEGER), 0) END
+    WHERE typeof(last_hour_reset) != 'integer' OR typeof(last_day_reset) != 'integer';
+    CREATE TABLE IF NOT EXISTS analytics (
+        id INTEGER PRIMARY KEY,
+        timestamp TIMESTAMP,
+        user_id_hash TEXT,
+        career_field TEXT,
+        employment_status TEXT,
+        request_success BOOLEAN
+    );
+    CREATE TABLE IF NOT EXISTS llm_cache (
+        profile_hash TEXT PRIMARY KEY,
+        courses_json TEXT,
+        created_at INTEGER
+    );
+'''
+
+SQLITE_INDEXES = '''
+    CREATE INDEX IF NOT EXISTS idx_analytics_ts ON analytics(timestamp);
+'''
+
+# Older databases keyed analytics on a random UUID; the table is rebuilt with an integer rowid key
+SQLITE_ANALYTICS_RENAME = '''
+    ALTER TABLE analytics RENAME TO analytics_legacy;
+'''
+
+SQLITE_ANALYTICS_COPY = '''
+    INSERT INTO analytics (timestamp, user_id_hash, career_field, employment_status, request_success)
+    SELECT timestamp, user_id_hash, career_field, employment_status, request_success
+    FROM analytics_legacy ORDER BY timestamp;
+    DROP TABLE analytics_legacy;
+'''
+
 def init_database():
     """Initialize database tables - works for both PostgreSQL and SQLite"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    if config.use_postgres:
-        # PostgreSQL syntax
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS rate_limits (
-                user_id TEXT PRIMARY KEY,
-                hourly_count INTEGER DEFAULT 0,
-                daily_count INTEGER DEFAULT 0,
-                last_hour_reset TIMESTAMP,
-                last_day_reset TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS analytics (
-                id TEXT PRIMARY KEY,
-                timestamp TIMESTAMP,
-                user_id_hash TEXT,
-                career_field TEXT,
-                employment_status TEXT,
-                request_success BOOLEAN
-            )
-        ''')
-    else:
-        # SQLite syntax
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS rate_limits (
-                user_id TEXT PRIMARY KEY,
-                hourly_count INTEGER DEFAULT 0,
-                daily_count INTEGER DEFAULT 0,
-                last_hour_reset TIMESTAMP,
-                last_day_reset TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS analytics (
-                id TEXT PRIMARY KEY,
-                timestamp TIMESTAMP,
-                user_id_hash TEXT,
-                career_field TEXT,
-                employment_status TEXT,
-                request_success BOOLEAN
-            )
-        ''')
+    with write_connection() as conn:
+        if config.use_postgres:
+            cursor = conn.cursor()
+            # Migrations and index builds on a large table can outlast the request timeout
+            cursor.execute('SET statement_timeout = 0')
+            cursor.execute(PG_SCHEMA)
+            conn.commit()
+            
+            conn.autocommit = True
+            try:
+                from psycopg2 import sql
+                cursor.execute(PG_INVALID_INDEXES, (list(PG_INDEX_NAMES),))
+                for (index_name,) in cursor.fetchall():
+                    cursor.execute(sql.SQL('DROP INDEX CONCURRENTLY IF EXISTS {}').format(sql.Identifier(index_name)))
+                for statement in PG_INDEXES:
+                    cursor.execute(statement)
+            finally:
+                cursor.execute('RESET statement_timeout')
+                conn.autocommit = False
+        else:
+            cursor = conn.execute("SELECT type FROM pragma_table_info('analytics') WHERE name = 'id'")
+            legacy = cursor.fetchone()
+            if legacy and legacy[0].upper() == 'TEXT':
+                script = SQLITE_ANALYTICS_RENAME + SQLITE_TABLES + SQLITE_ANALYTICS_COPY + SQLITE_INDEXES
+            else:
+                script = SQLITE_TABLES + SQLITE_INDEXES
+            # WAL lets readers proceed while a writer commits; it is persistent but cannot change mid-transaction
+            conn.executescript(f"PRAGMA journal_mode=WAL; BEGIN IMMEDIATE; {script} COMMIT;")
     
-    conn.commit()
-    conn.close()
     print("✓ Database initialized successfully")
 
 # Rate limiting functions
+@lru_cache(maxsize=10_000)
+def _hash_session(session_data):
+    """Hash session data into a short anonymous ID - repeat requests in a session reuse it"""
+    return hashlib.blake2b(session_data.encode(), digest_size=8).hexdigest()
+
 def get_user_id(request_info):
     """Generate anonymous user ID based on session"""
-    session_data = str(request_info) + str(time.time() // 3600)  # Hour-based sessions
-    return hashlib.sha256(session_data.encode()).hexdigest()[:16]
+    hour = time.time_ns() // 3_600_000_000_000  # Hour-based sessions, without a float to format
+    return _hash_session(f"{request_info}{hour}")
+
+# One statement per request: reset expired windows, then increment only while under both limits
+SQLITE_RATE_LIMIT_UPSERT = '''
+    INSERT INTO rate_limits (user_id, hourly_count, daily_count, last_hour_reset, last_day_reset)
+    VALUES (:user_id, 1, 1, :now, :now)
+    ON CONFLICT(user_id) DO UPDATE SET
+        hourly_count = CASE WHEN :now - last_hour_reset > 3600 THEN 1 ELSE hourly_count + 1 END,
+        daily_count = CASE WHEN :now - last_day_reset > 86400 THEN 1 ELSE daily_count + 1 END,
+        last_hour_reset = CASE WHEN :now - last_hour_reset > 3600 THEN :now ELSE last_hour_reset END,
+        last_day_reset = CASE WHEN :now - last_day_reset > 86400 THEN :now ELSE last_day_reset END
+    WHERE (CASE WHEN :now - last_hour_reset > 3600 THEN 0 ELSE hourly_count END) < :max_hour
+      AND (CASE WHEN :now - last_day_reset > 86400 THEN 0 ELSE daily_count END) < :max_day
+    RETURNING hourly_count
+'''
+
+# Rolling hour/day windows as sorted sets scored by request time, trimmed, checked and added to atomically
+REDIS_RATE_LIMIT_SCRIPT = '''
+    local now = tonumber(ARGV[1])
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - 3600)
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now - 86400)
+    if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+        local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+        return {0, tonumber(oldest[2])}
+    end
+    if redis.call('ZCARD', KEYS[2]) >= tonumber(ARGV[4]) then
+        return {0, 0}
+    end
+    redis.call('ZADD', KEYS[1], now, ARGV[2])
+    redis.call('ZADD', KEYS[2], now, ARGV[2])
+    redis.call('EXPIRE', KEYS[1], 3600)
+    redis.call('EXPIRE', KEYS[2], 86400)
+    return {1, 0}
+'''
+
+def init_redis_rate_limit():
+    """Register the rate-limit script when REDIS_URL is set; None keeps limits in the database"""
+    if not config.redis_url:
+        return None
+    try:
+        import redis
+        client = redis.Redis.from_url(config.redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        print("✓ Using Redis for rate limiting")
+        # Script objects call EVALSHA and load the script on first use
+        return client.register_script(REDIS_RATE_LIMIT_SCRIPT)
+    except Exception as e:
+        print(f"⚠️ Redis rate limiting unavailable, using the database: {e}")
+        return None
+
+redis_rate_limit = init_redis_rate_limit()
+
+def check_rate_limit_redis(user_id):
+    """Check and record a request against the Redis windows"""
+    now = int(time.time())
+    # The braces pin both keys to the same cluster slot so the script can touch them together
+    allowed, oldest = redis_rate_limit(
+        keys=[f"rl:{{{user_id}}}:hour", f"rl:{{{user_id}}}:day"],
+        args=[now, f"{time.time_ns()}:{os.urandom(4).hex()}",
+              config.max_requests_per_hour, config.max_requests_per_day],
+    )
+    if allowed:
+        return True, "Request allowed"
+    if oldest:
+        return False, f"Hourly limit exceeded ({config.max_requests_per_hour}/hour). Try again in {60 - (now - oldest) // 60} minutes."
+    return False, f"Daily limit exceeded ({config.max_requests_per_day}/day). Try again tomorrow."
 
 def check_rate_limit(user_id):
     """Check if user has exceeded rate limits"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    now = datetime.now()
-    hour_ago = now - timedelta(hours=1)
-    day_ago = now - timedelta(days=1)
-    
-    # Get or create user rate limit record
-    if config.use_postgres:
-        cursor.execute('SELECT * FROM rate_limits WHERE user_id = %s', (user_id,))
-    else:
-        cursor.execute('SELECT * FROM rate_limits WHERE user_id = ?', (user_id,))
-    
-    record = cursor.fetchone()
+    if redis_rate_limit is not None:
+        try:
+            return check_rate_limit_redis(user_id)
+        except Exception as e:
+            print(f"⚠️ Redis rate limit check failed, using the database: {e}")
     
-    if not record:
-        # New user
+    now = int(time.time())
+    params = {
+        "user_id": user_id,
+        "now": now,
+        "max_hour": config.max_requests_per_hour,
+        "max_day": config.max_requests_per_day,
+    }
+    with write_connection() as conn:
+        cursor = conn.cursor()
         if config.use_postgres:
-            cursor.execute('''
-                INSERT INTO rate_limits (user_id, hourly_count, daily_count, last_hour_reset, last_day_reset)
-                VALUES (%s, 1, 1, %s, %s)
-            ''', (user_id, now, now))
+            prepare_statements(cursor).execute(
+                'EXECUTE rate_limit_upsert (%(user_id)s, %(now)s, %(max_hour)s, %(max_day)s)', params
+            )
         else:
-            cursor.execute('''
-                INSERT INTO rate_limits (user_id, hourly_count, daily_count, last_hour_reset, last_day_reset)
-                VALUES (?, 1, 1, ?, ?)
-            ''', (user_id, now, now))
+            cursor.execute(SQLITE_RATE_LIMIT_UPSERT, params)
+        allowed = cursor.fetchall()
         conn.commit()
-        conn.close()
-        return True, "First request"
-    
-    user_id_db, hourly_count, daily_count, last_hour_reset, last_day_reset = record
-    
-    # Parse timestamps
-    if config.use_postgres:
-        # PostgreSQL returns datetime objects directly
-        if isinstance(last_hour_reset, str):
-            last_hour_reset = datetime.fromisoformat(last_hour_reset)
-        if isinstance(last_day_reset, str):
-            last_day_reset = datetime.fromisoformat(last_day_reset)
-    else:
-        # SQLite returns strings
-        last_hour_reset = datetime.fromisoformat(last_hour_reset) if last_hour_reset else hour_ago
-        last_day_reset = datetime.fromisoformat(last_day_reset) if last_day_reset else day_ago
-    
-    # Reset counters if time periods have passed
-    if now - last_hour_reset > timedelta(hours=1):
-        hourly_count = 0
-        last_hour_reset = now
-    
-    if now - last_day_reset > timedelta(days=1):
-        daily_count = 0
-        last_day_reset = now
+        if allowed:
+            return True, "Request allowed"
+        
+        # Rejected - the row was left untouched, so read it back for the message
+        if config.use_postgres:
+            cursor.execute('EXECUTE rate_limit_row (%s)', (user_id,))
+        else:
+            cursor.execute('SELECT hourly_count, last_hour_reset FROM rate_limits WHERE user_id = ?', (user_id,))
+        hourly_count, last_hour_reset = cursor.fetchone()
     
-    # Check limits
-    if hourly_count >= config.max_requests_per_hour:
-        conn.close()
-        return False, f"Hourly limit exceeded ({config.max_requests_per_hour}/hour). Try again in {60 - (now - last_hour_reset).seconds // 60} minutes."
+    if now - last_hour_reset <= 3600 and hourly_count >= config.max_requests_per_hour:
+        return False, f"Hourly limit exceeded ({config.max_requests_per_hour}/hour). Try again in {60 - (now - last_hour_reset) // 60} minutes."
+    return False, f"Daily limit exceeded ({config.max_requests_per_day}/day). Try again tomorrow."
+
+# Analytics rows are queued and written in batches by a background thread
+# Bounded so a writer that cannot reach the database never grows the heap without limit
+_ANALYTICS_Q = queue.Queue(maxsize=10_000)
+_ANALYTICS_WRITER_LOCK = threading.Lock()
+_analytics_writer_started = False
+_analytics_dropped = 0
+_ANALYTICS_BATCH_SIZE = 100
+_ANALYTICS_FLUSH_SECONDS = 0.2
+
+# PostgreSQL batches at least this large are streamed with COPY instead of INSERT
+_ANALYTICS_COPY_MIN_ROWS = 50
+
+# COPY text format escapes for backslash, tab and line breaks; NULL is written as \N
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+def _copy_field(value):
+    """Render one value in PostgreSQL COPY text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return str(value).translate(_COPY_ESCAPES)
+
+def _write_analytics_batch(rows):
+    """Insert a batch of analytics rows in one transaction"""
+    with write_connection() as conn:
+        cursor = conn.cursor()
     
-    if daily_count >= config.max_requests_per_day:
-        conn.close()
-        return False, f"Daily limit exceeded ({config.max_requests_per_day}/day). Try again tomorrow."
+        if config.use_postgres:
+            # Analytics can lose the last flush on a server crash, so skip the WAL fsync wait
+            cursor.execute('SET LOCAL synchronous_commit TO OFF')
     
-    # Increment counters
-    if config.use_postgres:
-        cursor.execute('''
-            UPDATE rate_limits 
-            SET hourly_count = %s, daily_count = %s, last_hour_reset = %s, last_day_reset = %s
-            WHERE user_id = %s
-        ''', (hourly_count + 1, daily_count + 1, last_hour_reset, last_day_reset, user_id))
-    else:
-        cursor.execute('''
-            UPDATE rate_limits 
-            SET hourly_count = ?, daily_count = ?, last_hour_reset = ?, last_day_reset = ?
-            WHERE user_id = ?
-        ''', (hourly_count + 1, daily_count + 1, last_hour_reset, last_day_reset, user_id))
+        if config.use_postgres and len(rows) >= _ANALYTICS_COPY_MIN_ROWS:
+            buffer = io.StringIO(''.join('\t'.join(map(_copy_field, row)) + '\n' for row in rows))
+            cursor.copy_expert('''
+                COPY analytics (timestamp, user_id_hash, career_field, employment_status, request_success)
+                FROM STDIN WITH (FORMAT text)
+            ''', buffer)
+        elif config.use_postgres and len(rows) == 1:
+            # A quiet period flushes single rows - reuse the prepared plan for those
+            prepare_statements(cursor).execute('EXECUTE log_analytics (%s, %s, %s, %s, %s)', rows[0])
+        elif config.use_postgres:
+            # One multi-row INSERT rather than a statement per row
+            from psycopg2.extras import execute_values
+            execute_values(cursor, '''
+                INSERT INTO analytics (timestamp, user_id_hash, career_field, employment_status, request_success)
+                VALUES %s
+            ''', rows)
+        else:
+            cursor.executemany('''
+                INSERT INTO analytics (timestamp, user_id_hash, career_field, employment_status, request_success)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
     
-    conn.commit()
-    conn.close()
-    return True, "Request allowed"
+        conn.commit()
+
+def _analytics_writer():
+    """Drain the analytics queue - up to a batch of rows or a short wait per flush"""
+    while True:
+        rows = [_ANALYTICS_Q.get()]
+        deadline = time.monotonic() + _ANALYTICS_FLUSH_SECONDS
+        while len(rows) < _ANALYTICS_BATCH_SIZE:
+            try:
+                rows.append(_ANALYTICS_Q.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        
+        try:
+            _write_analytics_batch(rows)
+        except Exception as e:
+            print(f"⚠️ Analytics write failed ({len(rows)} rows dropped): {e}")
+
+def start_analytics_writer():
+    """Start the background analytics writer once per process"""
+    global _analytics_writer_started
+    with _ANALYTICS_WRITER_LOCK:
+        if not _analytics_writer_started:
+            threading.Thread(target=_analytics_writer, name="analytics-writer", daemon=True).start()
+            _analytics_writer_started = True
 
 def log_analytics(user_id, career_field, employment_status, success):
     """Log basic analytics without PII"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    global _analytics_dropped
+    # user_id comes from get_user_id, which is already an anonymous 16-hex-char hash
+    user_id_hash = user_id
     
-    user_id_hash = hashlib.sha256(user_id.encode()).hexdigest()[:16]
+    # Started here rather than in init_database, so analytics resume once the database is reachable
+    if not _analytics_writer_started:
+        start_analytics_writer()
     
-    if config.use_postgres:
-        cursor.execute('''
-            INSERT INTO analytics (id, timestamp, user_id_hash, career_field, employment_status, request_success)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        ''', (str(uuid.uuid4()), datetime.now(), user_id_hash, career_field, employment_status, success))
-    else:
-        cursor.execute('''
-            INSERT INTO analytics (id, timestamp, user_id_hash, career_field, employment_status, request_success)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (str(uuid.uuid4()), datetime.now(), user_id_hash, career_field, employment_status, success))
+    try:
+        _ANALYTICS_Q.put_nowait((datetime.now().isoformat(sep=' '), user_id_hash, career_field, employment_status, success))
+    except queue.Full:
+        with _ANALYTICS_WRITER_LOCK:
+            _analytics_dropped += 1
+            dropped = _analytics_dropped
+        if dropped == 1 or dropped % 1000 == 0:
+            print(f"⚠️ Analytics queue full - {dropped} rows dropped so far")
+
+# Recommendation cache keyed by profile - persisted in the database, memoised per process
+LLM_CACHE_TTL = 7 * 24 * 3600
+
+def get_profile_hash(*fields):
+    """Hash the normalized profile fields into a cache key"""
+    # Case and spacing differences in the free-text fields still map to the same entry
+    profile = '|'.join(' '.join(str(field or '').split()).casefold() for field in fields)
+    return hashlib.blake2b(profile.encode(), digest_size=16).hexdigest()
+
+@lru_cache(maxsize=256)
+def _load_cached_courses(profile_hash):
+    """Load cached courses from the database - misses raise so they are not memoised"""
+    with read_connection() as conn:
+        cursor = conn.cursor()
+        
+        if config.use_postgres:
+            prepare_statements(cursor).execute(
+                'EXECUTE load_cached_courses (%s, %s)',
+                (profile_hash, int(time.time()) - LLM_CACHE_TTL)
+            )
+        else:
+            cursor.execute(
+                'SELECT courses_json, created_at FROM llm_cache WHERE profile_hash = ? AND created_at > ?',
+                (profile_hash, int(time.time()) - LLM_CACHE_TTL)
+            )
+        
+        record = cursor.fetchone()
     
-    conn.commit()
-    conn.close()
+    if not record:
+        raise KeyError(profile_hash)
+    return orjson.loads(record[0]), record[1]
+
+def get_cached_courses(profile_hash):
+    """Return cached courses for a profile, or None if missing or expired"""
+    try:
+        courses_data, created_at = _load_cached_courses(profile_hash)
+    except KeyError:
+        return None
+    
+    if time.time() - created_at > LLM_CACHE_TTL:
+        # lru_cache cannot evict one key, and expiries are rare enough to drop them all
+        _load_cached_courses.cache_clear()
+        return None
+    return courses_data
+
+def store_cached_courses(profile_hash, courses_data):
+    """Save parsed model output for a profile"""
+    with write_connection() as conn:
+        cursor = conn.cursor()
+        
+        if config.use_postgres:
+            prepare_statements(cursor).execute(
+                'EXECUTE store_cached_courses (%s, %s, %s)',
+                (profile_hash, orjson.dumps(courses_data).decode(), int(time.time()))
+            )
+        else:
+            cursor.execute('''
+                INSERT INTO llm_cache (profile_hash, courses_json, created_at) VALUES (?, ?, ?)
+                ON CONFLICT (profile_hash) DO UPDATE SET courses_json = excluded.courses_json, created_at = excluded.created_at
+            ''', (profile_hash, orjson.dumps(courses_data).decode(), int(time.time())))
+        
+        conn.commit()
+
+# Cache writes run off the request path; the reply is already formatted from the parsed data
+_CACHE_WRITER = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-writer")
+
+def _report_cache_write(future):
+    """Log a failed background cache write - the request has already been answered"""
+    if future.exception() is not None:
+        print(f"⚠️ Cache write failed: {future.exception()}")
+
+def queue_cached_courses(profile_hash, courses_data):
+    """Store parsed model output for a profile on the background writer"""
+    _CACHE_WRITER.submit(store_cached_courses, profile_hash, courses_data).add_done_callback(_report_cache_write)
 
 # Configure AI model
+# Shape of the reply enforced through Gemini's JSON mode
+_COURSE_FIELDS = ("title", "platform", "cost", "certificate_cost", "duration", "description", "disclaimer")
+COURSES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "courses": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {field: {"type": "string"} for field in _COURSE_FIELDS},
+                "required": ["title", "platform", "cost", "duration", "description"],
+            },
+        },
+    },
+    "required": ["courses"],
+}
+
 try:
     config.validate_api_key()
     genai.configure(api_key=config.api_key)
-    model = genai.GenerativeModel("gemini-2.5-flash")
+    model = genai.GenerativeModel(
+        "gemini-2.5-flash",
+        generation_config=genai.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=COURSES_SCHEMA,
+        ),
+    )
 except Exception as e:
     model = None
     print(f"AI Model configuration failed: {e}")
 
+# Caps in-flight Gemini requests so a burst of users queues here instead of hitting quota errors
+_GENERATION_SLOTS = asyncio.Semaphore(config.max_concurrent_generations)
+
 MODEL_INSTRUCTIONS = """
 You are a friendly career development advisor for South African learners
 and professionals. Recommend 1-5 practical short courses that can boost
@@ -258,19 +697,26 @@ CRITICAL REQUIREMENTS:
 - Add disclaimer about verifying course details
 """
 
+# Course search URL per platform, matched in order against the platform name
+_PLATFORM_URLS = (
+    ('coursera', "https://www.coursera.org/search?query={q}"),
+    ('edx', "https://www.edx.org/search?q={q}"),
+    ('linkedin', "https://www.linkedin.com/learning/search?keywords={q}"),
+    ('udemy', "https://www.udemy.com/courses/search/?q={q}"),
+    ('futurelearn', "https://www.futurelearn.com/search?q={q}"),
+    ('google', "https://learndigital.withgoogle.com/digitalskills"),
+    ('digiskills', "https://www.digiskillsafrica.com"),
+)
+
 def generate_course_card_html(course_data, index):
     """Generate HTML for a single course card with enhanced security"""
     
-    # Sanitize inputs to prevent XSS
-    def sanitize_text(text):
-        if not text:
-            return ""
-        return str(text).replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
-    
-    title = sanitize_text(course_data.get('title', 'Course Title'))
-    platform = sanitize_text(course_data.get('platform', 'Platform'))
-    description = sanitize_text(course_data.get('description', 'Great for career development'))
-    duration = sanitize_text(course_data.get('duration', 'Duration varies'))
+    # Escape inputs to prevent XSS
+    title_raw = str(course_data.get('title', 'Course Title') or '')
+    title = escape(title_raw)
+    platform = escape(str(course_data.get('platform', 'Platform') or ''))
+    description = escape(str(course_data.get('description', 'Great for career development') or ''))
+    duration = escape(str(course_data.get('duration', 'Duration varies') or ''))
     
     # Determine cost styling
     cost_raw = course_data.get('cost', '')
@@ -278,31 +724,19 @@ def generate_course_card_html(course_data, index):
         cost_class = "cost-free"
         cost_text = "Free"
         if course_data.get('certificate_cost'):
-            cost_text += f" (Certificate: {sanitize_text(course_data.get('certificate_cost'))})"
+            cost_text += f" (Certificate: {escape(str(course_data.get('certificate_cost')))})"
     else:
         cost_class = "cost-paid"
-        cost_text = sanitize_text(cost_raw) if cost_raw else 'Contact for pricing'
+        cost_text = escape(str(cost_raw)) if cost_raw else 'Contact for pricing'
     
     # Generate safe search URLs
-    search_query = title.replace(' ', '+').replace('&', 'and')
+    search_query = quote_plus(title_raw)
     platform_lower = platform.lower()
     
-    if 'coursera' in platform_lower:
-        course_url = f"https://www.coursera.org/search?query={search_query}"
-    elif 'edx' in platform_lower:
-        course_url = f"https://www.edx.org/search?q={search_query}"
-    elif 'linkedin' in platform_lower:
-        course_url = f"https://www.linkedin.com/learning/search?keywords={search_query}"
-    elif 'udemy' in platform_lower:
-        course_url = f"https://www.udemy.com/courses/search/?q={search_query}"
-    elif 'futurelearn' in platform_lower:
-        course_url = f"https://www.futurelearn.com/search?q={search_query}"
-    elif 'google' in platform_lower:
-        course_url = "https://learndigital.withgoogle.com/digitalskills"
-    elif 'digiskills' in platform_lower:
-        course_url = "https://www.digiskillsafrica.com"
-    else:
-        course_url = f"https://www.google.com/search?q={search_query}+online+course"
+    course_url = next(
+        (template.format(q=search_query) for key, template in _PLATFORM_URLS if key in platform_lower),
+        f"https://www.google.com/search?q={search_query}+online+course"
+    )
     
     return f"""
     <div class="course-card">
@@ -348,69 +782,32 @@ def generate_course_card_html(course_data, index):
     </div>
     """
 
-def format_courses_response(courses_data):
-    """Format the complete courses response with enhanced styling"""
-    
-    if not courses_data or 'courses' not in courses_data:
-        return "<div class='error-message'>❌ Unable to generate course recommendations. Please try again.</div>"
-    
-    courses = courses_data['courses']
-    if not courses:
-        return "<div class='error-message'>❌ No courses found matching your criteria. Please adjust your preferences and try again.</div>"
-    
-    # Generate header
-    header_html = """
-    <div class="recommendations-header">
-        <div class="header-content">
-            <div class="back-button" id="back-button-header">
-                <span class="back-icon">←</span>
-                <span class="back-text">Back to Profile</span>
-            </div>
-            <h2 class="main-title">Your Personalized Course Recommendations</h2>
-            <p class="profile-subtitle">Curated for the South African job market</p>
-        </div>
-    </div>
-    """
-    
-    # Generate course cards
-    cards_html = ""
-    for index, course in enumerate(courses):
-        cards_html += generate_course_card_html(course, index)
-    
-    # Add disclaimer section
-    disclaimer_html = """
-    <div class="global-disclaimer">
-        <h4>📋 Important Information:</h4>
-        <ul>
-            <li>Course recommendations are AI-generated - always verify current availability and pricing</li>
-            <li>Prices shown are estimates in South African Rands</li>
-            <li>Course content and requirements may change</li>
-            <li>We may earn affiliate commissions from course enrollments</li>
-            <li>This service is provided for educational guidance only</li>
-        </ul>
-    </div>
-    """
-    
-    # Enhanced styling with better UX
-    full_html = f"""
-    <style>
-        .recommendations-container {{
+def minify_css(css):
+    """Strip comments and whitespace from a stylesheet"""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};:,])\s*', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+# Static parts of the recommendations response, built once at import
+_CARD_CSS = """
+        .recommendations-container {
             font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
             max-width: 800px;
             margin: 0 auto;
             background: #f8f9fa;
             border-radius: 12px;
             overflow: hidden;
-        }}
+        }
         
-        .recommendations-header {{
+        .recommendations-header {
             background: linear-gradient(135deg, #4285f4, #34a853);
             color: white;
             padding: 24px;
             text-align: center;
-        }}
+        }
         
-        .back-button {{
+        .back-button {
             display: inline-flex;
             align-items: center;
             gap: 8px;
@@ -421,98 +818,98 @@ def format_courses_response(courses_data):
             cursor: pointer;
             font-size: 14px;
             transition: background-color 0.2s;
-        }}
+        }
         
-        .back-button:hover {{
+        .back-button:hover {
             background: rgba(255,255,255,0.3);
-        }}
+        }
         
-        .main-title {{
+        .main-title {
             font-size: 24px;
             font-weight: 600;
             margin: 0 0 8px 0;
-        }}
+        }
         
-        .profile-subtitle {{
+        .profile-subtitle {
             font-size: 14px;
             opacity: 0.9;
             margin: 0;
-        }}
+        }
         
-        .course-card {{
+        .course-card {
             background: white;
             margin: 16px;
             padding: 20px;
             border-radius: 12px;
             border-left: 4px solid #4285f4;
             box-shadow: 0 2px 8px rgba(0,0,0,0.1);
-        }}
+        }
         
-        .course-header {{
+        .course-header {
             display: flex;
             align-items: flex-start;
             gap: 12px;
             margin-bottom: 16px;
-        }}
+        }
         
-        .course-title {{
+        .course-title {
             font-size: 18px;
             font-weight: 600;
             color: #1a1a1a;
             margin: 0;
             line-height: 1.3;
-        }}
+        }
         
-        .course-meta {{
+        .course-meta {
             display: flex;
             gap: 20px;
             margin-bottom: 12px;
             flex-wrap: wrap;
-        }}
+        }
         
-        .course-platform, .course-cost {{
+        .course-platform, .course-cost {
             display: flex;
             align-items: center;
             gap: 6px;
             font-size: 14px;
-        }}
+        }
         
-        .cost-free {{
+        .cost-free {
             background: #e8f5e8;
             padding: 4px 8px;
             border-radius: 12px;
-        }}
+        }
         
-        .cost-free .cost-text {{
+        .cost-free .cost-text {
             color: #2e7d32;
             font-weight: 500;
-        }}
+        }
         
-        .cost-paid {{
+        .cost-paid {
             background: #fff3e0;
             padding: 4px 8px;
             border-radius: 12px;
-        }}
+        }
         
-        .cost-paid .cost-text {{
+        .cost-paid .cost-text {
             color: #ef6c00;
             font-weight: 500;
-        }}
+        }
         
-        .course-duration {{
+        .course-duration {
             display: flex;
             align-items: center;
             gap: 6px;
             margin-bottom: 16px;
             font-size: 14px;
             color: #666;
-        }}
+        }
         
-        .course-description {{
+        .course-description {
             margin-bottom: 16px;
-        }}
+        }
         
-        .description-header {{
+        .description-header {
             display: flex;
             align-items: center;
             gap: 8px;
@@ -520,15 +917,15 @@ def format_courses_response(courses_data):
             font-size: 14px;
             font-weight: 500;
             color: #333;
-        }}
+        }
         
-        .description-content .description-text {{
+        .description-content .description-text {
             font-size: 14px;
             color: #666;
             line-height: 1.4;
-        }}
+        }
         
-        .course-link {{
+        .course-link {
             display: flex;
             align-items: center;
             justify-content: center;
@@ -541,107 +938,162 @@ def format_courses_response(courses_data):
             font-weight: 500;
             transition: background-color 0.2s;
             margin-bottom: 12px;
-        }}
+        }
         
-        .course-link:hover {{
+        .course-link:hover {
             background: #3367d6;
             text-decoration: none;
             color: white;
-        }}
+        }
         
-        .course-disclaimer {{
+        .course-disclaimer {
             font-size: 12px;
             color: #999;
             font-style: italic;
             border-top: 1px solid #eee;
             padding-top: 8px;
-        }}
+        }
         
-        .global-disclaimer {{
+        .global-disclaimer {
             background: #fff3cd;
             border: 1px solid #ffeaa7;
             border-radius: 8px;
             padding: 16px;
             margin: 16px;
             font-size: 13px;
-        }}
+        }
         
-        .global-disclaimer h4 {{
+        .global-disclaimer h4 {
             color: #856404;
             margin: 0 0 8px 0;
-        }}
+        }
         
-        .global-disclaimer ul {{
+        .global-disclaimer ul {
             margin: 8px 0 0 0;
             padding-left: 20px;
-        }}
+        }
         
-        .global-disclaimer li {{
+        .global-disclaimer li {
             margin-bottom: 4px;
             color: #856404;
-        }}
+        }
         
-        .error-message {{
+        .error-message {
             background: #ffebee;
             color: #c62828;
             padding: 20px;
             border-radius: 8px;
             margin: 16px;
             text-align: center;
-        }}
-    </style>
-    
-    <div class="recommendations-container">
-        {header_html}
-        {cards_html}
-        {disclaimer_html}
+        }
+"""
+
+_CSS_BLOCK = f"<style>{minify_css(_CARD_CSS)}</style>"
+
+_HEADER_HTML = """
+    <div class="recommendations-header">
+        <div class="header-content">
+            <div class="back-button" id="back-button-header">
+                <span class="back-icon">←</span>
+                <span class="back-text">Back to Profile</span>
+            </div>
+            <h2 class="main-title">Your Personalized Course Recommendations</h2>
+            <p class="profile-subtitle">Curated for the South African job market</p>
+        </div>
     </div>
-    
+    """
+
+_DISCLAIMER_HTML = """
+    <div class="global-disclaimer">
+        <h4>📋 Important Information:</h4>
+        <ul>
+            <li>Course recommendations are AI-generated - always verify current availability and pricing</li>
+            <li>Prices shown are estimates in South African Rands</li>
+            <li>Course content and requirements may change</li>
+            <li>We may earn affiliate commissions from course enrollments</li>
+            <li>This service is provided for educational guidance only</li>
+        </ul>
+    </div>
+    """
+
+_SCRIPT_HTML = """
     <script>
-        setTimeout(function() {{
+        setTimeout(function() {
             var backButton = document.getElementById('back-button-header');
-            if (backButton) {{
-                backButton.addEventListener('click', function() {{
-                    var hiddenBackBtn = document.querySelector('#back-btn button');
-                    if (hiddenBackBtn) {{
-                        hiddenBackBtn.click();
-                    }}
-                }});
-            }}
-        }}, 1000);
+            if (backButton) {
+                backButton.addEventListener('click', function() {
+                    var mainBtn = document.getElementById('submit-btn');
+                    if (mainBtn) {
+                        mainBtn.click();
+                    }
+                });
+            }
+        }, 1000);
     </script>
-    """
+"""
+
+# Decodes course objects out of a partial streamed reply, one raw_decode per object
+_STREAM_DECODER = json.JSONDecoder()
+
+def parse_streamed_courses(reply, position, courses):
+    """Append the course objects completed since position and return where to resume"""
+    if position is None:
+        # Nothing before the courses array opens can be decoded
+        start = reply.find('[')
+        if start < 0:
+            return None
+        position = start + 1
+    
+    while True:
+        start = reply.find('{', position)
+        if start < 0:
+            break
+        try:
+            course, position = _STREAM_DECODER.raw_decode(reply, start)
+        except ValueError:
+            # This object has not closed yet - retry once more of the reply arrives
+            break
+        courses.append(course)
+    return position
+
+def format_courses_response(courses_data):
+    """Format the complete courses response with enhanced styling"""
+    
+    if not courses_data or 'courses' not in courses_data:
+        return "<div class='error-message'>❌ Unable to generate course recommendations. Please try again.</div>"
+    
+    courses = courses_data['courses']
+    if not courses:
+        return "<div class='error-message'>❌ No courses found matching your criteria. Please adjust your preferences and try again.</div>"
     
-    return full_html
+    # Generate course cards
+    cards_html = ''.join(generate_course_card_html(course, index) for index, course in enumerate(courses))
+    
+    return f'{_CSS_BLOCK}<div class="recommendations-container">{_HEADER_HTML}{cards_html}{_DISCLAIMER_HTML}</div>{_SCRIPT_HTML}'
+
+# Labels for the free-text fields a profile cannot be submitted without
+_REQUIRED_FIELDS = ("Current Role", "Career Goals", "Skills of Interest")
 
-def chat_with_recommendations(currentRole, educationLevel, employmentStatus, 
+async def chat_with_recommendations(currentRole, educationLevel, employmentStatus, 
                             careerGoals, skillsInterest, experienceLevel, costPreference, 
                             history, request_info=None):
     """Main function to generate course recommendations with security"""
     
-    # Validate required fields
-    required_fields = {
-        "Current Role": currentRole,
-        "Career Goals": careerGoals,
-        "Skills of Interest": skillsInterest
-    }
-    
-    missing_fields = [field for field, value in required_fields.items() if not value or not value.strip()]
+    # Validate required fields - the cheap checks run before any database or model work
+    values = (currentRole, careerGoals, skillsInterest)
+    missing_fields = [field for field, value in zip(_REQUIRED_FIELDS, values) if not value or not value.strip()]
     if missing_fields:
-        return f"⚠️ Please fill in the following required fields: {', '.join(missing_fields)}", history
+        yield f"⚠️ Please fill in the following required fields: {', '.join(missing_fields)}", history
+        return
     
     # Generate user ID for rate limiting (using currentRole and skillsInterest instead of email)
-    user_id = get_user_id(f"{currentRole}{skillsInterest}{time.time() // 3600}")
-    
-    # Check rate limits
-    rate_limit_ok, rate_limit_msg = check_rate_limit(user_id)
-    if not rate_limit_ok:
-        return f"⏰ {rate_limit_msg}", history
+    # get_user_id already appends the hour bucket
+    user_id = get_user_id(currentRole + skillsInterest)
     
     # Check if AI model is available
     if not model:
         log_analytics(user_id, currentRole, employmentStatus, False)
-        return """🔑 **Google API Key Required**
+        yield """🔑 **Google API Key Required**
 
 To get course recommendations, you need a Google API key:
 
@@ -651,7 +1103,14 @@ To get course recommendations, you need a Google API key:
 4. Restart the application
 
 Google Gemini offers generous free limits! 🚀""", history
+        return
 
+    # Check rate limits
+    rate_limit_ok, rate_limit_msg = await asyncio.to_thread(check_rate_limit, user_id)
+    if not rate_limit_ok:
+        yield f"⏰ {rate_limit_msg}", history
+        return
+    
     # Create user profile for AI
     user_input = f"""
 {MODEL_INSTRUCTIONS}
@@ -669,33 +1128,45 @@ Please provide personalized course recommendations as a valid JSON object.
 """
 
     try:
-        # Generate AI response
-        response = model.generate_content(user_input)
-        reply = response.text
+        # Identical profiles reuse a cached answer instead of another model round trip
+        profile_hash = get_profile_hash(currentRole, educationLevel, employmentStatus, careerGoals,
+                                        skillsInterest, experienceLevel, costPreference)
+        courses_data = await asyncio.to_thread(get_cached_courses, profile_hash)
+        
+        if courses_data is None:
+            # Stream the reply and show each course card as soon as its object closes
+            reply, courses, position = '', [], None
+            async with _GENERATION_SLOTS:
+                async for chunk in await model.generate_content_async(user_input, stream=True):
+                    # A chunk with no parts (e.g. the final finish_reason chunk) raises on .text
+                    if not chunk.parts:
+                        continue
+                    reply += chunk.text
+                    shown = len(courses)
+                    position = parse_streamed_courses(reply, position, courses)
+                    if len(courses) > shown:
+                        yield format_courses_response({"courses": courses}), history
 
-        # Parse JSON response
-        try:
-            json_start = reply.find('{')
-            json_end = reply.rfind('}') + 1
+            # Parse JSON response
+            try:
+                # JSON mode returns the bare object, no prose or code fences to strip
+                courses_data = orjson.loads(reply)
             
-            if json_start != -1 and json_end != 0:
-                json_str = reply[json_start:json_end]
-                courses_data = json.loads(json_str)
-            else:
-                courses_data = json.loads(reply)
+                if isinstance(courses_data, dict) and courses_data.get('courses'):
+                    queue_cached_courses(profile_hash, courses_data)
         
-        except json.JSONDecodeError:
-            # Fallback with disclaimer
-            courses_data = {
-                "courses": [{
-                    "title": "Course recommendations available",
-                    "platform": "Multiple platforms",
-                    "cost": "Varies (Free to R2000+)",
-                    "duration": "2-12 weeks typically",
-                    "description": f"Based on your interest in {skillsInterest}, there are many relevant courses available. Please search the suggested platforms for current offerings.",
-                    "disclaimer": "AI processing encountered an issue - please search manually"
-                }]
-            }
+            except orjson.JSONDecodeError:
+                # Fallback with disclaimer (e.g. a reply cut off at the token limit)
+                courses_data = {
+                    "courses": [{
+                        "title": "Course recommendations available",
+                        "platform": "Multiple platforms",
+                        "cost": "Varies (Free to R2000+)",
+                        "duration": "2-12 weeks typically",
+                        "description": f"Based on your interest in {skillsInterest}, there are many relevant courses available. Please search the suggested platforms for current offerings.",
+                        "disclaimer": "AI processing encountered an issue - please search manually"
+                    }]
+                }
         
         # Format response
         formatted_reply = format_courses_response(courses_data)
@@ -703,10 +1174,10 @@ Please provide personalized course recommendations as a valid JSON object.
         # Log successful analytics
         log_analytics(user_id, currentRole, employmentStatus, True)
         
-        # Update history
-        new_history = history + [{"user_input": user_input, "response": formatted_reply}]
+        # Update history - the session owns this list, so append in place
+        history.append({"user_input": user_input, "response": formatted_reply})
         
-        return formatted_reply, new_history
+        yield formatted_reply, history
 
     except Exception as e:
         # Log failed analytics
@@ -714,7 +1185,7 @@ Please provide personalized course recommendations as a valid JSON object.
         
         error_msg = str(e)
         if "quota" in error_msg.lower() or "limit" in error_msg.lower():
-            return """⏰ **Rate Limit Reached**
+            yield """⏰ **Rate Limit Reached**
 
 Google Gemini free tier limits reached. Please try again in a few minutes.
 
@@ -725,7 +1196,7 @@ Google Gemini free tier limits reached. Please try again in a few minutes.
 
 The service will be available again shortly! ⏱️""", history
         else:
-            return f"""⚠️ **Service Temporarily Unavailable**
+            yield f"""⚠️ **Service Temporarily Unavailable**
 
 We're experiencing technical difficulties. Please try again in a few minutes.
 
@@ -736,9 +1207,32 @@ We're experiencing technical difficulties. Please try again in a few minutes.
 
 Error details: {error_msg[:100]}...""", history
 
+# Placeholder shown in the output panel before the first request and after going back
+_INITIAL_OUTPUT_HTML = "<div style='text-align: center; padding: 40px; color: #666;'>Your tailored course recommendations will appear here! ✨</div>"
+
 def go_back_to_profile():
     """Reset to initial state"""
-    return "<div style='text-align: center; padding: 40px; color: #666;'>Your tailored course recommendations will appear here! ✨</div>"
+    return _INITIAL_OUTPUT_HTML
+
+# The main button doubles as the back button; its label decides which action a click takes
+_SUBMIT_LABEL = "🚀 Get My Course Recommendations"
+_BACK_LABEL = "Back to Profile"
+
+async def handle_main_button(currentRole, educationLevel, employmentStatus,
+                             careerGoals, skillsInterest, experienceLevel, costPreference,
+                             history, action):
+    """Submit the profile, or reset the output when the button reads Back to Profile"""
+    if action == _BACK_LABEL:
+        yield go_back_to_profile(), history, gr.update(value=_SUBMIT_LABEL)
+        return
+    
+    answered = len(history)
+    async for reply, history in chat_with_recommendations(currentRole, educationLevel, employmentStatus,
+                                                          careerGoals, skillsInterest, experienceLevel,
+                                                          costPreference, history):
+        # Only a finished answer is added to history - offer the way back once one is shown
+        label = _BACK_LABEL if len(history) > answered else _SUBMIT_LABEL
+        yield reply, history, gr.update(value=label)
 
 # Initialize database
 try:
@@ -747,41 +1241,8 @@ except Exception as e:
     print(f"⚠️ Database initialization warning: {e}")
     print("Application will continue but data may not persist")
 
-# Legal compliance components
-def create_legal_footer():
-    return gr.HTML("""
-    <div style="background: #f5f5f5; padding: 20px; margin-top: 40px; border-radius: 8px; font-size: 12px; color: #666;">
-        <div style="text-align: center; margin-bottom: 16px;">
-            <strong>Legal Information & Privacy</strong>
-        </div>
-        <div style="display: flex; gap: 30px; justify-content: center; flex-wrap: wrap;">
-            <div>
-                <strong>🔒 Privacy:</strong> We collect minimal data for service improvement. 
-                No personal information is shared with third parties.
-            </div>
-            <div>
-                <strong>💰 Disclosure:</strong> We may earn affiliate commissions from course enrollments.
-            </div>
-            <div>
-                <strong>⚠️ Disclaimer:</strong> Course recommendations are AI-generated guidance only. 
-                Always verify current course details.
-            </div>
-        </div>
-        <div style="text-align: center; margin-top: 12px; font-size: 11px;">
-            <a href="#" style="color: #1e88e5;">Privacy Policy</a> | 
-            <a href="#" style="color: #1e88e5;">Terms of Service</a> | 
-            <a href="#" style="color: #1e88e5;">Contact Us</a>
-        </div>
-    </div>
-    """)
-
-# Main UI with enhanced security and compliance
-with gr.Blocks(theme=gr.themes.Base(), title="LWM Course Guide") as demo:
-    # Session state
-    state = gr.State([])
-    
-    # Header with compliance notice
-    gr.HTML("""
+# Static page sections, built once at import
+_PAGE_HEADER_HTML = """
     <div style="text-align: center; padding: 40px 20px;">
         <div style="width: 80px; height: 80px; background: linear-gradient(135deg, #1e88e5, #26a69a);
                    border-radius: 50%; margin: 0 auto 20px; display: flex; align-items: center; justify-content: center;">
@@ -796,10 +1257,10 @@ with gr.Blocks(theme=gr.themes.Base(), title="LWM Course Guide") as demo:
             <span style="font-size: 0.9em; color: #999;">🔒 Privacy-focused • ⚡ Free to use • 🏆 Trusted sources</span>
         </p>
     </div>
-    """)
+    """
 
-    # Service limits notice
-    gr.HTML("""
+# Service limits notice
+_LIMITS_NOTICE_HTML = """
     <div style="background: #e3f2fd; border-left: 4px solid #1e88e5; padding: 16px; margin: 20px 0; border-radius: 8px;">
         <div style="display: flex; align-items: center; gap: 8px; margin-bottom: 8px;">
             <span style="font-size: 16px;">ℹ️</span>
@@ -810,10 +1271,10 @@ with gr.Blocks(theme=gr.themes.Base(), title="LWM Course Guide") as demo:
             This helps us keep the service free while managing costs.
         </p>
     </div>
-    """)
+    """
 
-    # Profile form
-    gr.HTML("""
+# Profile form heading
+_PROFILE_INTRO_HTML = """
     <div style="background: white; border-radius: 15px; padding: 30px; margin: 20px 0; box-shadow: 0 4px 20px rgba(0,0,0,0.1);">
         <div style="text-align: center; margin-bottom: 30px;">
             <div style="width: 60px; height: 60px; background: linear-gradient(135deg, #1e88e5, #26a69a);
@@ -826,103 +1287,43 @@ with gr.Blocks(theme=gr.themes.Base(), title="LWM Course Guide") as demo:
             </p>
         </div>
     </div>
-    """)
-
-    with gr.Row():
-        with gr.Column():
-            currentRole = gr.Textbox(
-                label="Current Role/Field *",
-                placeholder="e.g., Marketing Assistant, Student, Unemployed",
-                info="Required - helps us recommend relevant skills"
-            )
-            employmentStatus = gr.Dropdown(
-                label="Employment Status",
-                choices=[
-                    "Employed Full-time",
-                    "Employed Part-time", 
-                    "Student",
-                    "Unemployed",
-                    "Freelancer/Self-employed",
-                    "Career Break"
-                ],
-                value=None
-            )
-            costPreference = gr.Dropdown(
-                label="Course Cost Preference",
-                choices=[
-                    "Free courses only",
-                    "Paid courses (up to R500)",
-                    "Paid courses (up to R2000)",
-                    "Any cost if valuable"
-                ],
-                value="Free courses only"
-            )
-        
-        with gr.Column():
-            educationLevel = gr.Dropdown(
-                label="Education Level",
-                choices=[
-                    "Matric/Grade 12",
-                    "Certificate",
-                    "Diploma",
-                    "Bachelor's Degree",
-                    "Honours Degree",
-                    "Master's Degree",
-                    "Doctorate"
-                ],
-                value=None
-            )
-            experienceLevel = gr.Dropdown(
-                label="Experience Level",
-                choices=[
-                    "Entry Level (0-2 years)",
-                    "Mid Level (3-5 years)",
-                    "Senior Level (5+ years)",
-                    "Executive Level"
-                ],
-                value="Entry Level (0-2 years)"
-            )
-            
-    careerGoals = gr.Textbox(
-        label="Career Goals *",
-        placeholder="Describe your career aspirations, target roles, or industries...",
-        lines=2,
-        info="Required - helps us understand your direction"
-    )
-    
-    skillsInterest = gr.Textbox(
-        label="Skills of Interest *",
-        placeholder="e.g., Digital Marketing, Data Analysis, Project Management, Python Programming",
-        info="Required - specific skills you want to develop"
-    )
+    """
 
-    # Output section
-    bot_reply = gr.HTML(
-        value="<div style='text-align: center; padding: 40px; color: #666;'>Your tailored course recommendations will appear here! ✨</div>",
-        elem_id="course-output"
-    )
+# Legal compliance footer
+_LEGAL_FOOTER_HTML = """
+    <div style="background: #f5f5f5; padding: 20px; margin-top: 40px; border-radius: 8px; font-size: 12px; color: #666;">
+        <div style="text-align: center; margin-bottom: 16px;">
+            <strong>Legal Information & Privacy</strong>
+        </div>
+        <div style="display: flex; gap: 30px; justify-content: center; flex-wrap: wrap;">
+            <div>
+                <strong>🔒 Privacy:</strong> We collect minimal data for service improvement. 
+                No personal information is shared with third parties.
+            </div>
+            <div>
+                <strong>💰 Disclosure:</strong> We may earn affiliate commissions from course enrollments.
+            </div>
+            <div>
+                <strong>⚠️ Disclaimer:</strong> Course recommendations are AI-generated guidance only. 
+                Always verify current course details.
+            </div>
+        </div>
+        <div style="text-align: center; margin-top: 12px; font-size: 11px;">
+            <a href="#" style="color: #1e88e5;">Privacy Policy</a> | 
+            <a href="#" style="color: #1e88e5;">Terms of Service</a> | 
+            <a href="#" style="color: #1e88e5;">Contact Us</a>
+        </div>
+    </div>
+    """
 
-    # Main action button
-    send_btn = gr.Button(
-        "🚀 Get My Course Recommendations",
-        variant="primary",
-        size="lg",
-        elem_id="submit-btn"
-    )
-    
-    # Hidden back button
-    back_btn = gr.Button(
-        "Back to Profile",
-        visible=False,
-        elem_id="back-btn"
-    )
+def create_legal_footer():
+    return gr.HTML(_LEGAL_FOOTER_HTML)
 
-    # Legal footer
-    create_legal_footer()
+# Header, limits notice and profile heading render as a single component
+_INTRO_HTML = _PAGE_HEADER_HTML + _LIMITS_NOTICE_HTML + _PROFILE_INTRO_HTML
 
-    # Enhanced CSS
-    gr.HTML("""
-<style>
+# Enhanced CSS - kept readable here, minified once at import
+_APP_CSS_SOURCE = """
     * { max-width: 100%; overflow-wrap: break-word; }
     
     #submit-btn {
@@ -1004,36 +1405,173 @@ with gr.Blocks(theme=gr.themes.Base(), title="LWM Course Guide") as demo:
             margin: 8px 5px !important;
         }
     }
-</style>
-""")
+"""
 
-    # Event handlers
-    send_btn.click(
-        fn=chat_with_recommendations,
-        inputs=[currentRole, educationLevel, employmentStatus, careerGoals, 
-                skillsInterest, experienceLevel, costPreference, state],
-        outputs=[bot_reply, state]
+_APP_CSS = f"<style>{minify_css(_APP_CSS_SOURCE)}</style>"
+
+# Dropdown choices, shared by every session
+_EMPLOYMENT_CHOICES = (
+    "Employed Full-time",
+    "Employed Part-time",
+    "Student",
+    "Unemployed",
+    "Freelancer/Self-employed",
+    "Career Break",
+)
+
+_COST_CHOICES = (
+    "Free courses only",
+    "Paid courses (up to R500)",
+    "Paid courses (up to R2000)",
+    "Any cost if valuable",
+)
+
+_EDUCATION_CHOICES = (
+    "Matric/Grade 12",
+    "Certificate",
+    "Diploma",
+    "Bachelor's Degree",
+    "Honours Degree",
+    "Master's Degree",
+    "Doctorate",
+)
+
+_EXPERIENCE_CHOICES = (
+    "Entry Level (0-2 years)",
+    "Mid Level (3-5 years)",
+    "Senior Level (5+ years)",
+    "Executive Level",
+)
+
+# Client-side check of the required profile fields; throwing cancels the request before it reaches the server.
+# Gradio passes the input values followed by the output values, so the list is trimmed back to the inputs.
+# The last input is the button label - going back needs no check.
+_PROFILE_PRECHECK_JS = """
+(...args) => {
+    const inputs = args.slice(0, %(inputs)d);
+    const [role, , , goals, skills] = inputs;
+    if (inputs[inputs.length - 1] === '%(back_label)s') {
+        return inputs;
+    }
+    const missing = [['Current Role', role], ['Career Goals', goals], ['Skills of Interest', skills]]
+        .filter(([, value]) => !(value || '').trim())
+        .map(([label]) => label);
+    document.getElementById('profile-precheck')?.remove();
+    if (missing.length) {
+        const warning = document.createElement('div');
+        warning.id = 'profile-precheck';
+        warning.style.cssText = 'text-align: center; padding: 20px; color: #c62828;';
+        warning.textContent = '⚠️ Please fill in the following required fields: ' + missing.join(', ');
+        document.querySelector('#course-output .prose')?.prepend(warning);
+        throw new Error('Missing required fields');
+    }
+    return inputs;
+}
+"""
+
+# Main UI with enhanced security and compliance
+with gr.Blocks(theme=gr.themes.Base(), title="LWM Course Guide") as demo:
+    # Session state
+    state = gr.State([])
+    
+    # Header with compliance notice, service limits and profile heading
+    gr.HTML(_INTRO_HTML)
+
+    with gr.Row():
+        with gr.Column():
+            currentRole = gr.Textbox(
+                label="Current Role/Field *",
+                placeholder="e.g., Marketing Assistant, Student, Unemployed",
+                info="Required - helps us recommend relevant skills"
+            )
+            employmentStatus = gr.Dropdown(
+                label="Employment Status",
+                choices=_EMPLOYMENT_CHOICES,
+                value=None
+            )
+            costPreference = gr.Dropdown(
+                label="Course Cost Preference",
+                choices=_COST_CHOICES,
+                value="Free courses only"
+            )
+        
+        with gr.Column():
+            educationLevel = gr.Dropdown(
+                label="Education Level",
+                choices=_EDUCATION_CHOICES,
+                value=None
+            )
+            experienceLevel = gr.Dropdown(
+                label="Experience Level",
+                choices=_EXPERIENCE_CHOICES,
+                value="Entry Level (0-2 years)"
+            )
+            
+    careerGoals = gr.Textbox(
+        label="Career Goals *",
+        placeholder="Describe your career aspirations, target roles, or industries...",
+        lines=2,
+        info="Required - helps us understand your direction"
     )
     
-    back_btn.click(
-        fn=go_back_to_profile,
-        outputs=[bot_reply]
+    skillsInterest = gr.Textbox(
+        label="Skills of Interest *",
+        placeholder="e.g., Digital Marketing, Data Analysis, Project Management, Python Programming",
+        info="Required - specific skills you want to develop"
+    )
+
+    # Output section
+    bot_reply = gr.HTML(
+        value=_INITIAL_OUTPUT_HTML,
+        elem_id="course-output"
+    )
+
+    # Main action button - relabelled to Back to Profile while recommendations are shown
+    send_btn = gr.Button(
+        _SUBMIT_LABEL,
+        variant="primary",
+        size="lg",
+        elem_id="submit-btn"
+    )
+
+    # Legal footer
+    create_legal_footer()
+
+    # Enhanced CSS
+    gr.HTML(_APP_CSS)
+
+    # Event handlers - profile inputs in chat_with_recommendations argument order
+    _PROFILE_INPUTS = [currentRole, educationLevel, employmentStatus, careerGoals,
+                       skillsInterest, experienceLevel, costPreference, state]
+
+    send_btn.click(
+        fn=handle_main_button,
+        inputs=_PROFILE_INPUTS + [send_btn],
+        outputs=[bot_reply, state, send_btn],
+        js=_PROFILE_PRECHECK_JS % {"inputs": len(_PROFILE_INPUTS) + 1, "back_label": _BACK_LABEL},
+        # Gradio runs one instance of an event at a time by default; the generation semaphore is the real cap
+        concurrency_limit=config.max_concurrent_generations,
     )
 
 
 # 🔥 CRITICAL: Launch configuration for Railway
+@lru_cache(maxsize=1)
+def _server_config():
+    """Keyword arguments for demo.launch, read from the environment once"""
+    return {
+        "server_name": "0.0.0.0",
+        "server_port": int(os.environ.get("PORT", 7860)),
+        "share": False,
+        "show_error": True,
+    }
+
 if __name__ == "__main__":
-    port = int(os.environ.get("PORT", 7860))
+    server_config = _server_config()
     
-    print(f"🚀 Starting application on port {port}")
+    print(f"🚀 Starting application on port {server_config['server_port']}")
     print(f"📊 Database: {'PostgreSQL' if config.use_postgres else 'SQLite'}")
     
-    demo.launch(
-        server_name="0.0.0.0",
-        server_port=port,
-        share=False,
-        show_error=True
-    )
+    demo.launch(**server_config)
 
 
 
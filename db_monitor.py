@@ -5,61 +5,76 @@ Monitor users, analytics, and system health
 """
 
 import psycopg2
+from psycopg2.extensions import make_dsn
 from psycopg2.extras import RealDictCursor
+import io
 import os
-from datetime import datetime, timedelta
+import sys
 import json
-from dotenv import load_dotenv
-from urllib.parse import urlparse
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime
+from decimal import Decimal
 
-# Load environment variables
-load_dotenv()
+# Load environment variables - Railway injects them, so .env is only read for local runs
+if not os.getenv("DATABASE_URL") and not os.getenv("PGHOST"):
+    from dotenv import load_dotenv
+    load_dotenv()
+
+def build_dsn():
+    """Build the monitor's connection string from DATABASE_URL or Railway's PG* variables"""
+    database_url = os.getenv("DATABASE_URL")
+    if database_url:
+        return make_dsn(database_url, sslmode='require')
+    
+    # Fallback for Railway auto-provided variables
+    db_host = os.getenv("PGHOST")
+    db_port = os.getenv("PGPORT", "5432")
+    db_name = os.getenv("PGDATABASE")
+    db_user = os.getenv("PGUSER")
+    db_password = os.getenv("PGPASSWORD")
+    
+    if all([db_host, db_name, db_user, db_password]):
+        return make_dsn(host=db_host, port=db_port, dbname=db_name,
+                        user=db_user, password=db_password, sslmode='require')
+    return None
+
+# Parsed once at import - every connection reuses the same DSN string
+_DSN = build_dsn()
 
 class DatabaseMonitor:
     def __init__(self):
-        self.database_url = os.getenv("DATABASE_URL")
-        
-        if not self.database_url:
-            # Fallback for Railway auto-provided variables
-            db_host = os.getenv("PGHOST")
-            db_port = os.getenv("PGPORT", "5432")
-            db_name = os.getenv("PGDATABASE")
-            db_user = os.getenv("PGUSER")
-            db_password = os.getenv("PGPASSWORD")
-            
-            if all([db_host, db_name, db_user, db_password]):
-                self.database_url = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
-        
-        if self.database_url:
-            parsed = urlparse(self.database_url)
-            self.db_config = {
-                'host': parsed.hostname,
-                'port': parsed.port or 5432,
-                'database': parsed.path[1:],
-                'user': parsed.username,
-                'password': parsed.password,
-                'sslmode': 'require'
-            }
-        else:
+        if not _DSN:
             raise ValueError("PostgreSQL connection details not found")
+        self.dsn = _DSN
+        
+        # One session and cursor for the whole run - each query would otherwise pay its own TLS handshake
+        self.conn = None
+        self.cursor = None
 
-    def get_connection(self):
-        """Get database connection"""
+    @contextmanager
+    def db_cursor(self):
+        """Yield the shared dict cursor, opening the connection on first use and dropping it if it breaks"""
+        if self.conn is None or self.conn.closed:
+            self.conn = psycopg2.connect(self.dsn)
+            # Autocommit keeps one failed query from aborting the rest of the report
+            self.conn.set_session(readonly=True, autocommit=True)
+            self.cursor = self.conn.cursor(cursor_factory=RealDictCursor)
         try:
-            return psycopg2.connect(**self.db_config)
-        except Exception as e:
-            print(f"❌ Database connection failed: {e}")
-            return None
+            yield self.cursor
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # A lost connection is closed here so the next query reconnects
+            self.close()
+            raise
 
-    def get_daily_stats(self, days=7):
-        """Get daily usage statistics"""
-        conn = self.get_connection()
-        if not conn:
-            return None
-        
-        try:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
+    def close(self):
+        """Close the shared connection and its cursor"""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = self.cursor = None
+
+    def fetch_daily_stats(self, days=7):
+        """Query daily usage statistics"""
+        with self.db_cursor() as cursor:
             query = """
             SELECT 
                 DATE(timestamp) as date,
@@ -67,50 +82,44 @@ class DatabaseMonitor:
                 COUNT(*) FILTER (WHERE request_success = true) as successful_requests,
                 COUNT(*) FILTER (WHERE request_success = false) as failed_requests,
                 COUNT(DISTINCT user_id_hash) as unique_users,
-                ROUND(AVG(processing_time_ms), 2) as avg_processing_time_ms
+                ROUND(AVG(processing_time_ms), 2) as avg_processing_time_ms,
+                SUM(COUNT(*)) OVER ()::bigint as grand_total
             FROM analytics 
             WHERE timestamp >= CURRENT_DATE - INTERVAL '%s days'
             GROUP BY DATE(timestamp)
             ORDER BY date DESC;
             """
-            
+        
             cursor.execute(query, (days,))
-            results = cursor.fetchall()
-            
+            return cursor.fetchall()
+
+    def get_daily_stats(self, days=7):
+        """Get daily usage statistics"""
+        try:
+            results = self.fetch_daily_stats(days)
+        
             print(f"\n📊 DAILY STATISTICS (Last {days} days)")
             print("=" * 80)
             print(f"{'Date':<12} {'Total':<8} {'Success':<8} {'Failed':<8} {'Users':<8} {'Avg Time(ms)':<12}")
             print("-" * 80)
-            
-            total_requests = 0
-            total_users = set()
-            
+        
             for row in results:
-                total_requests += row['total_requests']
                 print(f"{row['date']:<12} {row['total_requests']:<8} {row['successful_requests']:<8} "
                       f"{row['failed_requests']:<8} {row['unique_users']:<8} {row['avg_processing_time_ms'] or 'N/A':<12}")
-            
+        
             print("-" * 80)
-            print(f"Total Requests: {total_requests}")
-            
+            # Every row carries the window total; an empty window has no rows
+            print(f"Total Requests: {results[0]['grand_total'] if results else 0}")
+        
             return results
-            
+        
         except Exception as e:
             print(f"❌ Error getting daily stats: {e}")
             return None
-        finally:
-            cursor.close()
-            conn.close()
 
-    def get_user_profiles(self, limit=20):
-        """Get recent user profiles"""
-        conn = self.get_connection()
-        if not conn:
-            return None
-        
-        try:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
+    def fetch_user_profiles(self, limit=20):
+        """Query recent user profiles"""
+        with self.db_cursor() as cursor:
             query = """
             SELECT 
                 id,
@@ -128,13 +137,18 @@ class DatabaseMonitor:
             ORDER BY created_at DESC 
             LIMIT %s;
             """
-            
+        
             cursor.execute(query, (limit,))
-            results = cursor.fetchall()
-            
+            return cursor.fetchall()
+
+    def get_user_profiles(self, limit=20):
+        """Get recent user profiles"""
+        try:
+            results = self.fetch_user_profiles(limit)
+        
             print(f"\n👥 RECENT USER PROFILES (Last {len(results)})")
             print("=" * 120)
-            
+        
             for row in results:
                 print(f"\n🆔 User Hash: {row['user_id_hash']}")
                 print(f"   Role: {row['current_role']}")
@@ -146,25 +160,16 @@ class DatabaseMonitor:
                 print(f"   Cost Pref: {row['cost_preference']}")
                 print(f"   Created: {row['created_at']}")
                 print("-" * 120)
-            
+        
             return results
-            
+        
         except Exception as e:
             print(f"❌ Error getting user profiles: {e}")
             return None
-        finally:
-            cursor.close()
-            conn.close()
 
-    def get_popular_career_fields(self, limit=10):
-        """Get most popular career fields"""
-        conn = self.get_connection()
-        if not conn:
-            return None
-        
-        try:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
+    def fetch_popular_career_fields(self, limit=10):
+        """Query the most popular career fields"""
+        with self.db_cursor() as cursor:
             query = """
             SELECT 
                 career_field,
@@ -182,38 +187,34 @@ class DatabaseMonitor:
             ORDER BY request_count DESC 
             LIMIT %s;
             """
-            
+        
             cursor.execute(query, (limit,))
-            results = cursor.fetchall()
-            
+            return cursor.fetchall()
+
+    def get_popular_career_fields(self, limit=10):
+        """Get most popular career fields"""
+        try:
+            results = self.fetch_popular_career_fields(limit)
+        
             print(f"\n🔥 TOP CAREER FIELDS (Last 30 days)")
             print("=" * 90)
             print(f"{'Career Field':<30} {'Requests':<10} {'Users':<8} {'Success':<10} {'Rate %':<8}")
             print("-" * 90)
-            
+        
             for row in results:
                 print(f"{row['career_field'][:29]:<30} {row['request_count']:<10} "
                       f"{row['unique_users']:<8} {row['successful_requests']:<10} "
                       f"{row['success_rate_percent']:<8}")
-            
+        
             return results
-            
+        
         except Exception as e:
             print(f"❌ Error getting career fields: {e}")
             return None
-        finally:
-            cursor.close()
-            conn.close()
 
-    def get_recent_recommendations(self, limit=10):
-        """Get recent course recommendations"""
-        conn = self.get_connection()
-        if not conn:
-            return None
-        
-        try:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
+    def fetch_recent_recommendations(self, limit=10):
+        """Query recent course recommendations"""
+        with self.db_cursor() as cursor:
             query = """
             SELECT 
                 user_id_hash,
@@ -226,60 +227,70 @@ class DatabaseMonitor:
             ORDER BY created_at DESC 
             LIMIT %s;
             """
-            
+        
             cursor.execute(query, (limit,))
-            results = cursor.fetchall()
-            
+            return cursor.fetchall()
+
+    def get_recent_recommendations(self, limit=10):
+        """Get recent course recommendations"""
+        try:
+            results = self.fetch_recent_recommendations(limit)
+        
             print(f"\n📝 RECENT RECOMMENDATIONS (Last {len(results)})")
             print("=" * 100)
-            
+        
             for row in results:
                 print(f"\n🆔 User: {row['user_id_hash']}")
                 print(f"   Session: {row['session_id']}")
                 print(f"   Courses: {row['courses_count']} | Success: {'✅' if row['success'] else '❌'}")
                 print(f"   Created: {row['created_at']}")
-                
+            
                 # Show first course recommendation
                 if row['recommendation_data'] and 'courses' in row['recommendation_data']:
                     courses = row['recommendation_data']['courses']
                     if courses:
                         first_course = courses[0]
                         print(f"   First Course: {first_course.get('title', 'N/A')} ({first_course.get('platform', 'N/A')})")
-                
-                print("-" * 100)
             
+                print("-" * 100)
+        
             return results
-            
+        
         except Exception as e:
             print(f"❌ Error getting recommendations: {e}")
             return None
-        finally:
-            cursor.close()
-            conn.close()
 
-    def get_rate_limit_stats(self):
-        """Get rate limiting statistics"""
-        conn = self.get_connection()
-        if not conn:
-            return None
-        
-        try:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
+    def fetch_rate_limit_stats(self):
+        """Query rate limiting statistics and the top users"""
+        with self.db_cursor() as cursor:
+            # Summary and top users in one round trip; top_users comes back as a JSON list
             query = """
+            WITH top AS (
+                SELECT user_id, daily_count, to_timestamp(last_day_reset) AS last_day_reset 
+                FROM rate_limits 
+                WHERE daily_count > 5 
+                ORDER BY daily_count DESC 
+                LIMIT 5
+            )
             SELECT 
                 COUNT(*) as total_users,
                 COUNT(*) FILTER (WHERE hourly_count >= 8) as near_hourly_limit,
                 COUNT(*) FILTER (WHERE daily_count >= 40) as near_daily_limit,
                 AVG(hourly_count) as avg_hourly_usage,
                 AVG(daily_count) as avg_daily_usage,
-                MAX(daily_count) as max_daily_usage
+                MAX(daily_count) as max_daily_usage,
+                (SELECT json_agg(top ORDER BY daily_count DESC) FROM top) as top_users
             FROM rate_limits;
             """
-            
+        
             cursor.execute(query)
-            stats = cursor.fetchone()
-            
+            return cursor.fetchone()
+
+    def get_rate_limit_stats(self):
+        """Get rate limiting statistics"""
+        try:
+            stats = self.fetch_rate_limit_stats()
+        
             print(f"\n⏰ RATE LIMITING STATISTICS")
             print("=" * 60)
             print(f"Total Users: {stats['total_users']}")
@@ -288,40 +299,23 @@ class DatabaseMonitor:
             print(f"Avg Hourly Usage: {stats['avg_hourly_usage']:.1f}")
             print(f"Avg Daily Usage: {stats['avg_daily_usage']:.1f}")
             print(f"Max Daily Usage: {stats['max_daily_usage']}")
-            
-            # Get top users by usage
-            cursor.execute("""
-                SELECT user_id, daily_count, last_day_reset 
-                FROM rate_limits 
-                WHERE daily_count > 5 
-                ORDER BY daily_count DESC 
-                LIMIT 5;
-            """)
-            
-            top_users = cursor.fetchall()
+        
+            # Top users by usage
+            top_users = stats['top_users']
             if top_users:
                 print(f"\n🔥 Top Users by Daily Usage:")
                 for user in top_users:
                     print(f"   {user['user_id']}: {user['daily_count']} requests (last reset: {user['last_day_reset']})")
-            
+        
             return stats
-            
+        
         except Exception as e:
             print(f"❌ Error getting rate limit stats: {e}")
             return None
-        finally:
-            cursor.close()
-            conn.close()
 
-    def get_error_analysis(self):
-        """Analyze errors and failures"""
-        conn = self.get_connection()
-        if not conn:
-            return None
-        
-        try:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-            
+    def fetch_error_analysis(self):
+        """Query recent errors and failures"""
+        with self.db_cursor() as cursor:
             # Get error messages
             query = """
             SELECT 
@@ -336,13 +330,18 @@ class DatabaseMonitor:
             ORDER BY error_count DESC 
             LIMIT 10;
             """
-            
+        
             cursor.execute(query)
-            errors = cursor.fetchall()
-            
+            return cursor.fetchall()
+
+    def get_error_analysis(self):
+        """Analyze errors and failures"""
+        try:
+            errors = self.fetch_error_analysis()
+        
             print(f"\n🚨 ERROR ANALYSIS (Last 7 days)")
             print("=" * 100)
-            
+        
             if errors:
                 for error in errors:
                     print(f"Count: {error['error_count']:<5} | Last: {error['last_occurrence']}")
@@ -350,15 +349,12 @@ class DatabaseMonitor:
                     print("-" * 100)
             else:
                 print("✅ No errors found in the last 7 days!")
-            
+        
             return errors
-            
+        
         except Exception as e:
             print(f"❌ Error analyzing errors: {e}")
             return None
-        finally:
-            cursor.close()
-            conn.close()
 
     def run_full_report(self):
         """Run complete monitoring report"""
@@ -367,52 +363,102 @@ class DatabaseMonitor:
         print(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         
         # Get all statistics
-        self.get_daily_stats(7)
-        self.get_popular_career_fields(10)
-        self.get_rate_limit_stats()
-        self.get_error_analysis()
-        self.get_recent_recommendations(5)
-        self.get_user_profiles(10)
+        report = {key: show(self, *args) for key, show, _, args in REPORT_SECTIONS}
         
         print("\n" + "=" * 80)
         print("✅ Monitoring report completed!")
+        return report
+
+# Full report sections: (key, print step, fetch step, arguments)
+REPORT_SECTIONS = (
+    ('daily', DatabaseMonitor.get_daily_stats, DatabaseMonitor.fetch_daily_stats, (7,)),
+    ('careers', DatabaseMonitor.get_popular_career_fields, DatabaseMonitor.fetch_popular_career_fields, (10,)),
+    ('rates', DatabaseMonitor.get_rate_limit_stats, DatabaseMonitor.fetch_rate_limit_stats, ()),
+    ('errors', DatabaseMonitor.get_error_analysis, DatabaseMonitor.fetch_error_analysis, ()),
+    ('recommendations', DatabaseMonitor.get_recent_recommendations, DatabaseMonitor.fetch_recent_recommendations, (5,)),
+    ('users', DatabaseMonitor.get_user_profiles, DatabaseMonitor.fetch_user_profiles, (10,)),
+)
+
+# Subcommands by name: (print step, fetch step, default for the optional numeric argument)
+COMMANDS = {
+    "daily": (DatabaseMonitor.get_daily_stats, DatabaseMonitor.fetch_daily_stats, 7),
+    "users": (DatabaseMonitor.get_user_profiles, DatabaseMonitor.fetch_user_profiles, 20),
+    "careers": (DatabaseMonitor.get_popular_career_fields, DatabaseMonitor.fetch_popular_career_fields, 10),
+    "recommendations": (DatabaseMonitor.get_recent_recommendations, DatabaseMonitor.fetch_recent_recommendations, 10),
+    "rates": (DatabaseMonitor.get_rate_limit_stats, DatabaseMonitor.fetch_rate_limit_stats, None),
+    "errors": (DatabaseMonitor.get_error_analysis, DatabaseMonitor.fetch_error_analysis, None),
+}
+
+def json_default(value):
+    """Encode the Decimal and datetime values psycopg2 returns"""
+    return float(value) if isinstance(value, Decimal) else str(value)
+
+def fetch_or_none(name, fetch, monitor, args):
+    """Run one fetch step for JSON output, reporting a failure on stderr and returning None"""
+    try:
+        return fetch(monitor, *args)
+    except Exception as e:
+        print(f"❌ Error getting {name}: {e}", file=sys.stderr)
+        return None
+
+def print_usage(file=None):
+    """Print the available commands"""
+    print("Available commands:", file=file)
+    print("  daily [days]         - Daily statistics", file=file)
+    print("  users [limit]        - Recent user profiles", file=file)
+    print("  careers [limit]      - Popular career fields", file=file)
+    print("  recommendations [limit] - Recent recommendations", file=file)
+    print("  rates                - Rate limiting stats", file=file)
+    print("  errors               - Error analysis", file=file)
+    print("  (no command)         - Full report", file=file)
+    print("  --json               - Print results as JSON", file=file)
 
 def main():
-    """Main function with command line options"""
-    import sys
+    """Main function with command line options - returns the exit status"""
+    # --json swaps the formatted report for the query results as one JSON document
+    json_mode = "--json" in sys.argv[1:]
+    args = [arg for arg in sys.argv[1:] if arg != "--json"]
+    
+    # Unknown commands get the usage text before any connection settings are checked
+    command = COMMANDS.get(args[0].lower()) if args else None
+    if args and command is None:
+        print_usage(sys.stderr if json_mode else None)
+        return 0
+    
+    if command:
+        show, fetch, default = command
+        call_args = () if default is None else (int(args[1]) if len(args) > 1 else default,)
     
     monitor = DatabaseMonitor()
     
-    if len(sys.argv) > 1:
-        command = sys.argv[1].lower()
-        
-        if command == "daily":
-            days = int(sys.argv[2]) if len(sys.argv) > 2 else 7
-            monitor.get_daily_stats(days)
-        elif command == "users":
-            limit = int(sys.argv[2]) if len(sys.argv) > 2 else 20
-            monitor.get_user_profiles(limit)
-        elif command == "careers":
-            limit = int(sys.argv[2]) if len(sys.argv) > 2 else 10
-            monitor.get_popular_career_fields(limit)
-        elif command == "recommendations":
-            limit = int(sys.argv[2]) if len(sys.argv) > 2 else 10
-            monitor.get_recent_recommendations(limit)
-        elif command == "rates":
-            monitor.get_rate_limit_stats()
-        elif command == "errors":
-            monitor.get_error_analysis()
+    try:
+        if not json_mode:
+            if command:
+                show(monitor, *call_args)
+            else:
+                monitor.run_full_report()
+            return 0
+        
+        # JSON mode runs only the fetch steps; a failed query is reported on stderr and its section is null
+        if command:
+            result = fetch_or_none(args[0].lower(), fetch, monitor, call_args)
+            failed = result is None
         else:
-            print("Available commands:")
-            print("  daily [days]         - Daily statistics")
-            print("  users [limit]        - Recent user profiles")
-            print("  careers [limit]      - Popular career fields")
-            print("  recommendations [limit] - Recent recommendations")
-            print("  rates                - Rate limiting stats")
-            print("  errors               - Error analysis")
-            print("  (no command)         - Full report")
-    else:
-        monitor.run_full_report()
+            result = {key: fetch_or_none(key, fetch, monitor, section_args)
+                      for key, _, fetch, section_args in REPORT_SECTIONS}
+            failed = None in result.values()
+    finally:
+        monitor.close()
+    
+    print(json.dumps(result, default=json_default))
+    return 1 if failed else 0
 
 if __name__ == "__main__":
-    main()
+    # Collect the output and write it once - with PYTHONUNBUFFERED set, every print is its own write
+    report = io.StringIO()
+    try:
+        with redirect_stdout(report):
+            status = main()
+    finally:
+        sys.stdout.write(report.getvalue())
+    sys.exit(status)